@@ -1,27 +1,58 @@
 from eventmanager import Evt
 from .fpvscores import FPVScores
 from .fpvs_export import FPVSExport
+from .fpvs_profiler import FPVSProfiler
 
 
 def initialize(rhapi):
-    fpvscores = FPVScores(rhapi)
-    fpvs_export = FPVSExport(rhapi)
+    profiler = FPVSProfiler(rhapi)
+    fpvscores = FPVScores(rhapi, profiler)
+    fpvs_export = FPVSExport(rhapi, profiler)
 
+    rhapi.events.on(Evt.STARTUP, profiler.load_options, priority = 10)
     rhapi.events.on(Evt.STARTUP, fpvscores.init_plugin)
+    rhapi.events.on(Evt.OPTION_SET, profiler.option_listener)
 
-    rhapi.events.on(Evt.CLASS_ADD, fpvscores.class_listener,  priority = 20)
-    rhapi.events.on(Evt.CLASS_ALTER, fpvscores.class_listener,  priority = 50)
-    rhapi.events.on(Evt.CLASS_DELETE, fpvscores.class_delete)
+    rhapi.events.on(Evt.CLASS_ADD, profiler.wrap(fpvscores.class_listener),  priority = 20)
+    rhapi.events.on(Evt.CLASS_ALTER, profiler.wrap(fpvscores.class_listener),  priority = 50)
+    rhapi.events.on(Evt.CLASS_DELETE, profiler.wrap(fpvscores.class_delete))
 
-    rhapi.events.on(Evt.HEAT_GENERATE, fpvscores.heat_listener, priority = 99)
-    rhapi.events.on(Evt.HEAT_ALTER, fpvscores.heat_listener)
-    rhapi.events.on(Evt.HEAT_DELETE, fpvscores.heat_delete)
+    rhapi.events.on(Evt.HEAT_GENERATE, profiler.wrap(fpvscores.heat_listener), priority = 99)
+    rhapi.events.on(Evt.HEAT_ALTER, profiler.wrap(fpvscores.heat_listener))
+    rhapi.events.on(Evt.HEAT_DELETE, profiler.wrap(fpvscores.heat_delete))
 
-    rhapi.events.on(Evt.PILOT_ADD, fpvscores.pilot_listener, priority = 99)
-    rhapi.events.on(Evt.PILOT_ALTER, fpvscores.pilot_listener)
+    rhapi.events.on(Evt.PILOT_ADD, profiler.wrap(fpvscores.pilot_listener), priority = 99)
+    rhapi.events.on(Evt.PILOT_ALTER, profiler.wrap(fpvscores.pilot_listener))
     #rhapi.events.on(Evt.PILOT_DELETE, fpvscores.pilot_listener)
 
-    rhapi.events.on(Evt.LAPS_SAVE, fpvscores.results_listener)
-    rhapi.events.on(Evt.LAPS_RESAVE, fpvscores.results_listener)
-
-    rhapi.events.on(Evt.DATA_EXPORT_INITIALIZE, fpvs_export.register_handlers)
\ No newline at end of file
+    rhapi.events.on(Evt.LAPS_SAVE, profiler.wrap(fpvscores.results_listener))
+    rhapi.events.on(Evt.LAPS_RESAVE, profiler.wrap(fpvscores.results_listener))
+
+    rhapi.events.on(Evt.CLASS_ADD, profiler.wrap(fpvs_export.class_cache_listener))
+    rhapi.events.on(Evt.CLASS_ALTER, profiler.wrap(fpvs_export.class_cache_listener))
+    rhapi.events.on(Evt.CLASS_DUPLICATE, profiler.wrap(fpvs_export.class_cache_listener))
+    rhapi.events.on(Evt.CLASS_DELETE, profiler.wrap(fpvs_export.class_delete_cache_listener))
+
+    rhapi.events.on(Evt.HEAT_ADD, profiler.wrap(fpvs_export.heat_cache_listener))
+    rhapi.events.on(Evt.HEAT_ALTER, profiler.wrap(fpvs_export.heat_cache_listener))
+    rhapi.events.on(Evt.HEAT_DUPLICATE, profiler.wrap(fpvs_export.heat_cache_listener))
+    rhapi.events.on(Evt.HEAT_GENERATE, profiler.wrap(fpvs_export.heat_cache_listener))
+    rhapi.events.on(Evt.HEAT_DELETE, profiler.wrap(fpvs_export.heat_cache_listener))
+    rhapi.events.on(Evt.HEAT_SET, profiler.wrap(fpvs_export.heat_cache_listener))
+
+    rhapi.events.on(Evt.PILOT_ADD, profiler.wrap(fpvs_export.pilot_cache_listener))
+    rhapi.events.on(Evt.PILOT_ALTER, profiler.wrap(fpvs_export.pilot_cache_listener))
+    rhapi.events.on(Evt.PILOT_DELETE, profiler.wrap(fpvs_export.pilot_delete_cache_listener))
+
+    rhapi.events.on(Evt.LAPS_SAVE, profiler.wrap(fpvs_export.laps_cache_listener))
+    rhapi.events.on(Evt.LAPS_RESAVE, profiler.wrap(fpvs_export.laps_cache_listener))
+
+    rhapi.events.on(Evt.OPTION_SET, profiler.wrap(fpvs_export.option_cache_listener))
+    rhapi.events.on(Evt.ROUNDS_RESET, profiler.wrap(fpvs_export.clear_cache_listener))
+    rhapi.events.on(Evt.DATABASE_RESET, profiler.wrap(fpvs_export.clear_cache_listener))
+    rhapi.events.on(Evt.DATABASE_RECOVER, profiler.wrap(fpvs_export.clear_cache_listener))
+    rhapi.events.on(Evt.DATABASE_RESTORE, profiler.wrap(fpvs_export.clear_cache_listener))
+    rhapi.events.on(Evt.DATABASE_IMPORT, profiler.wrap(fpvs_export.clear_cache_listener))
+    rhapi.events.on(Evt.DATABASE_INITIALIZE, profiler.wrap(fpvs_export.clear_cache_listener))
+
+    rhapi.events.on(Evt.DATA_EXPORT_INITIALIZE, fpvs_export.register_handlers)
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class FPVSAvatars():
+    CACHE_DIR = 'plugins/fpvscores/static/avatars'
+    MAX_WORKERS = 8
+    MAX_BYTES = 2 * 1024 * 1024
+    TIMEOUT = (5, 15)
+    # Raster types only: avatars are served from the timer's own origin, where an SVG could run script
+    EXTENSIONS = {
+        'image/png': '.png',
+        'image/jpeg': '.jpg',
+        'image/gif': '.gif',
+        'image/webp': '.webp'
+    }
+
+    def __init__(self,rhapi,profiler,avatar_url):
+        self.logger = logging.getLogger(__name__)
+        self._rhapi = rhapi
+        self.profiler = profiler
+        self.avatar_url = avatar_url
+        self._lock = threading.Lock()
+        self._running = False
+        self._index = None
+
+    def index_path(self):
+        return os.path.join(self.CACHE_DIR, 'index.json')
+
+    def load_index(self):
+        if self._index is None:
+            try:
+                with open(self.index_path(), 'r') as file:
+                    index = json.load(file)
+            except (OSError, ValueError):
+                index = {}
+            # A damaged index only costs a fresh download of the affected avatars
+            if not isinstance(index, dict):
+                index = {}
+            self._index = {fpvs_uuid: entry for fpvs_uuid, entry in index.items() if isinstance(entry, dict) and isinstance(entry.get('file'), str)}
+        return self._index
+
+    def save_index(self):
+        tmp_path = self.index_path() + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self._index, file, indent='\t')
+        os.replace(tmp_path, self.index_path())
+
+    def pilot_uuids(self):
+        db = self._rhapi.db
+        uuids = {}
+        with self.profiler.span('pilot_uuids', 'db'):
+            for pilot in db.pilots:
+                fpvs_uuid = db.pilot_attribute_value(pilot.id, 'fpvs_uuid')
+                fpvs_uuid = fpvs_uuid.strip() if isinstance(fpvs_uuid, str) else None
+                if fpvs_uuid:
+                    uuids[fpvs_uuid] = pilot.id
+        return uuids
+
+    def start_download(self):
+        # Runs in the background so the quick button returns immediately
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+        threading.Thread(target=self.profiler.wrap(self.download_all), daemon=True).start()
+        return True
+
+    def download_all(self):
+        rhapi = self._rhapi
+        try:
+            summary = self.refresh(self.pilot_uuids())
+            self.logger.info("FPVScores.com avatars: {downloaded} downloaded, {unchanged} unchanged, {missing} missing, {failed} failed".format(**summary))
+            rhapi.ui.message_notify(rhapi.__("FPVScores: {downloaded} avatars downloaded, {unchanged} unchanged, {missing} missing, {failed} failed.".format(**summary)))
+            if summary['missing'] and summary['missing'] == sum(summary.values()):
+                self.logger.warning("FPVScores.com returned no avatar for any pilot. Check the avatar endpoint " + self.avatar_url)
+        except Exception:
+            self.logger.exception("FPVScores.com avatar download failed")
+            rhapi.ui.message_notify(rhapi.__("FPVScores: Avatar download failed."))
+        finally:
+            with self._lock:
+                self._running = False
+
+    def refresh(self, uuids):
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+        index = self.load_index()
+        summary = {'downloaded': 0, 'unchanged': 0, 'missing': 0, 'failed': 0}
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.MAX_WORKERS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        with session, ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as pool:
+            jobs = {fpvs_uuid: pool.submit(self.fetch, session, fpvs_uuid, index.get(fpvs_uuid)) for fpvs_uuid in uuids}
+
+        for fpvs_uuid, job in jobs.items():
+            try:
+                status, entry = job.result()
+            except (requests.RequestException, OSError) as e:
+                self.logger.warning("FPVScores.com avatar for " + fpvs_uuid + " could not be downloaded: " + str(e))
+                summary['failed'] += 1
+                continue
+
+            summary[status] += 1
+            if entry is None:
+                index.pop(fpvs_uuid, None)
+            else:
+                index[fpvs_uuid] = entry
+
+        for fpvs_uuid in set(index) - set(uuids):
+            del index[fpvs_uuid]
+        self.save_index()
+        self.remove_unreferenced()
+        return summary
+
+    def fetch(self, session, fpvs_uuid, entry):
+        headers = {}
+        if entry is not None and os.path.exists(os.path.join(self.CACHE_DIR, entry['file'])):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        with self.profiler.span('avatar', 'network', fpvs_uuid=fpvs_uuid):
+            with session.get(self.avatar_url.format(quote(fpvs_uuid, safe='')), headers=headers, timeout=self.TIMEOUT, stream=True) as r:
+                if r.status_code == 304:
+                    return 'unchanged', entry
+                # Only a real 404 evicts a cached avatar, any other bad reply keeps it
+                if r.status_code == 404:
+                    return 'missing', None
+                r.raise_for_status()
+
+                content_type = r.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if content_type not in self.EXTENSIONS:
+                    self.logger.warning("FPVScores.com avatar for " + fpvs_uuid + " is not an image: " + content_type)
+                    return 'failed', entry
+
+                content = self.read_limited(r)
+                if content is None:
+                    self.logger.warning("FPVScores.com avatar for " + fpvs_uuid + " is larger than " + str(self.MAX_BYTES) + " bytes")
+                    return 'failed', entry
+
+        # Avatars are stored by content hash, so pilots sharing an image share a file
+        digest = hashlib.sha256(content).hexdigest()
+        filename = digest + self.EXTENSIONS[content_type]
+        path = os.path.join(self.CACHE_DIR, filename)
+        if not os.path.exists(path):
+            tmp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+
+        return 'downloaded', {
+            'file': filename,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified')
+        }
+
+    def read_limited(self, r):
+        length = r.headers.get('Content-Length')
+        if length is not None and length.isdigit() and int(length) > self.MAX_BYTES:
+            return None
+        content = bytearray()
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            content.extend(chunk)
+            if len(content) > self.MAX_BYTES:
+                return None
+        return bytes(content)
+
+    def remove_unreferenced(self):
+        referenced = {entry['file'] for entry in self._index.values()}
+        for filename in os.listdir(self.CACHE_DIR):
+            if filename != 'index.json' and filename not in referenced:
+                os.remove(os.path.join(self.CACHE_DIR, filename))
@@ -0,0 +1,66 @@
+import logging
+import threading
+
+
+# Already-encoded JSON fragments of the FPVScores export, per section and entity id
+class FPVSFragmentCache():
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._fragments = {}
+        self._generations = {}
+        self._keys = {}
+
+    def generation(self, section):
+        # Taken before reading entities from the database, so fragments encoded
+        # from data that was invalidated in the meantime are never stored
+        with self._lock:
+            return (self._epoch, self._generations.get(section, 0))
+
+    def get(self, section, entity_id, version=None):
+        entry = self._fragments.get(section, {}).get(entity_id)
+        if entry is not None and entry[0] == version:
+            return entry[2]
+        return None
+
+    def put(self, section, entity_id, fragment, generation, version=None, group=None):
+        with self._lock:
+            if (self._epoch, self._generations.get(section, 0)) == generation:
+                self._fragments.setdefault(section, {})[entity_id] = (version, group, fragment)
+
+    def prune(self, section, entity_ids):
+        with self._lock:
+            fragments = self._fragments.get(section)
+            if fragments:
+                for entity_id in set(fragments) - set(entity_ids):
+                    del fragments[entity_id]
+
+    def validate(self, section, key):
+        # Drops the whole section when a value all of its fragments depend on changes
+        with self._lock:
+            changed = section in self._keys and self._keys[section] != key
+            self._keys[section] = key
+        if changed:
+            self.invalidate(section)
+
+    def invalidate(self, section, entity_id=None, group=None):
+        with self._lock:
+            self._generations[section] = self._generations.get(section, 0) + 1
+            fragments = self._fragments.get(section)
+            if not fragments:
+                return
+            if entity_id is None and group is None:
+                fragments.clear()
+            elif entity_id is not None:
+                fragments.pop(entity_id, None)
+            else:
+                for key in [key for key, entry in fragments.items() if entry[1] == group]:
+                    del fragments[key]
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._fragments.clear()
+            self._keys.clear()
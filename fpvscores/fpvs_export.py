@@ -4,13 +4,16 @@ from data_export import DataExporter
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy import inspect
 import re
+from .fpvs_cache import FPVSFragmentCache
 
 
 class FPVSExport():
 
-    def __init__(self,rhapi):
+    def __init__(self,rhapi,profiler):
         self.logger = logging.getLogger(__name__)
         self._rhapi = rhapi
+        self.profiler = profiler
+        self.fragments = FPVSFragmentCache()
 
     def register_handlers(self,args):
         if 'register_fn' in args:
@@ -22,13 +25,15 @@ class FPVSExport():
         return [
             DataExporter(
                 'JSON FPVScores Upload',
-                self.write_json,
-                self.assemble_fpvscoresUpload
+                self.profiler.wrap(self.write_json),
+                self.profiler.wrap(self.assemble_fpvscoresUpload)
             )
         ]
 
     def write_json(self,data):
-        payload = json.dumps(data, indent='\t', cls=AlchemyEncoder)
+        # data holds the already encoded JSON text of every top level section
+        with self.profiler.span('write_json', 'serialize'):
+            payload = '{\n' + ',\n'.join('\t' + json.dumps(key) + ': ' + value for key, value in data.items()) + '\n}'
 
         return {
             'data': payload,
@@ -38,41 +43,173 @@ class FPVSExport():
     
     def assemble_fpvscoresUpload(self,rhapi):
         payload = {}
-        payload['import_settings'] = 'upload_FPVScores'
-        payload['Pilot'] = self.assemble_pilots_complete(rhapi)
-        payload['Heat'] = rhapi.db.heats
-        payload['HeatNode'] = self.assemble_heatnodes_complete(rhapi)
-        payload['RaceClass'] = rhapi.db.raceclasses
-        payload['GlobalSettings'] = rhapi.db.options
-        payload['FPVScores_results'] = rhapi.eventresults.results
+        payload['import_settings'] = json.dumps('upload_FPVScores')
+        payload['Pilot'] = self.encode_array(self.assemble_pilots_complete(rhapi))
+        heats, heat_fragments = self.assemble_heats_complete(rhapi)
+        payload['Heat'] = self.encode_array(heat_fragments)
+        payload['HeatNode'] = self.encode_array(self.assemble_heatnodes_complete(rhapi))
+        raceclasses, raceclass_fragments = self.assemble_raceclasses_complete(rhapi)
+        payload['RaceClass'] = self.encode_array(raceclass_fragments)
+        payload['GlobalSettings'] = self.encode_array(self.assemble_options_complete(rhapi))
+        payload['FPVScores_results'] = self.assemble_results_complete(rhapi, heats, raceclasses)
         return payload
     
 
 
     def assemble_pilots_complete(self, rhapi):
-        payload = rhapi.db.pilots
-        for pilot in payload:
-            pilot.fpvsuuid = self.sanitize_input(rhapi.db.pilot_attribute_value(pilot.id, 'fpvs_uuid'))
-            pilot.country = self.sanitize_input(rhapi.db.pilot_attribute_value(pilot.id, 'country'))
-            self.sanitize_pilot_attributes(pilot)
-        return payload
+        generation = self.fragments.generation('Pilot')
+        with self.profiler.span('db.pilots', 'db'):
+            pilots = rhapi.db.pilots
+        return self.encode_section('Pilot', generation, pilots, prepare=self.complete_pilot)
+
+    def complete_pilot(self, pilot):
+        rhapi = self._rhapi
+        pilot.fpvsuuid = self.sanitize_input(rhapi.db.pilot_attribute_value(pilot.id, 'fpvs_uuid'))
+        pilot.country = self.sanitize_input(rhapi.db.pilot_attribute_value(pilot.id, 'country'))
+        self.sanitize_pilot_attributes(pilot)
+
+
+    def assemble_heats_complete(self, rhapi):
+        generation = self.fragments.generation('Heat')
+        with self.profiler.span('db.heats', 'db'):
+            heats = rhapi.db.heats
+        return heats, self.encode_section('Heat', generation, heats, version=('status', '_cache_status'))
 
 
     def assemble_heatnodes_complete(self,rhapi):
-        payload = rhapi.db.slots      
-        freqs = json.loads(rhapi.race.frequencyset.frequencies)
-        
-        for slot in payload:
-            if slot.node_index is not None and isinstance(slot.node_index, int):
-                slot.node_frequency_band = freqs['b'][slot.node_index] if len(freqs['b']) > slot.node_index else ' '
-                slot.node_frequency_c = freqs['c'][slot.node_index] if len(freqs['c']) > slot.node_index else ' '
-                slot.node_frequency_f = freqs['f'][slot.node_index] if len(freqs['f']) > slot.node_index else ' '
-            else:
-                slot.node_frequency_band = ' '
-                slot.node_frequency_c = ' '
-                slot.node_frequency_f = ' '
-            
-        return payload
+        frequencies = rhapi.race.frequencyset.frequencies
+        # Every slot fragment carries its node frequency, so a new frequency set drops them all
+        self.fragments.validate('HeatNode', frequencies)
+        generation = self.fragments.generation('HeatNode')
+        with self.profiler.span('db.slots', 'db'):
+            slots = rhapi.db.slots
+        freqs = json.loads(frequencies)
+        return self.encode_section('HeatNode', generation, slots, prepare=lambda slot: self.complete_heatnode(slot, freqs), version=('node_index',), group='heat_id')
+
+    def complete_heatnode(self, slot, freqs):
+        if slot.node_index is not None and isinstance(slot.node_index, int):
+            slot.node_frequency_band = freqs['b'][slot.node_index] if len(freqs['b']) > slot.node_index else ' '
+            slot.node_frequency_c = freqs['c'][slot.node_index] if len(freqs['c']) > slot.node_index else ' '
+            slot.node_frequency_f = freqs['f'][slot.node_index] if len(freqs['f']) > slot.node_index else ' '
+        else:
+            slot.node_frequency_band = ' '
+            slot.node_frequency_c = ' '
+            slot.node_frequency_f = ' '
+
+
+    def assemble_raceclasses_complete(self, rhapi):
+        generation = self.fragments.generation('RaceClass')
+        with self.profiler.span('db.raceclasses', 'db'):
+            raceclasses = rhapi.db.raceclasses
+        return raceclasses, self.encode_section('RaceClass', generation, raceclasses, version=('_cache_status',))
+
+
+    def assemble_options_complete(self, rhapi):
+        generation = self.fragments.generation('GlobalSettings')
+        with self.profiler.span('db.options', 'db'):
+            options = rhapi.db.options
+        return self.encode_section('GlobalSettings', generation, options)
+
+
+    def assemble_results_complete(self, rhapi, heats, raceclasses):
+        # RotorHazard bumps these results cache markers whenever it recomputes results,
+        # including after race format changes that fire none of the listened events
+        key = (
+            tuple((heat.id, getattr(heat, '_cache_status', None)) for heat in heats),
+            tuple((raceclass.id, getattr(raceclass, '_cache_status', None)) for raceclass in raceclasses)
+        )
+        self.fragments.validate('FPVScores_results', key)
+        generation = self.fragments.generation('FPVScores_results')
+        fragment = self.fragments.get('FPVScores_results', 0)
+        if fragment is None:
+            with self.profiler.span('eventresults.results', 'db'):
+                results = rhapi.eventresults.results
+            with self.profiler.span('FPVScores_results', 'serialize'):
+                fragment = self.encode(results, 1)
+            self.fragments.put('FPVScores_results', 0, fragment, generation)
+        return fragment
+
+
+    def encode_section(self, section, generation, entities, prepare=None, version=None, group=None):
+        # Only entities without a valid cached fragment are completed and encoded
+        fragments = []
+        dirty = []
+        for index, entity in enumerate(entities):
+            entity_version = tuple(getattr(entity, attr, None) for attr in version) if version else None
+            fragment = self.fragments.get(section, entity.id, entity_version)
+            if fragment is None:
+                dirty.append((index, entity, entity_version))
+            fragments.append(fragment)
+
+        if prepare is not None and dirty:
+            with self.profiler.span('complete_' + section, 'db', count=len(dirty)):
+                for index, entity, entity_version in dirty:
+                    prepare(entity)
+
+        with self.profiler.span(section, 'serialize', count=len(dirty)):
+            for index, entity, entity_version in dirty:
+                fragment = self.encode(entity, 2)
+                self.fragments.put(section, entity.id, fragment, generation, entity_version, getattr(entity, group) if group else None)
+                fragments[index] = fragment
+        self.fragments.prune(section, [entity.id for entity in entities])
+        return fragments
+
+    def encode(self, obj, depth):
+        # Same text json.dumps(indent='\t') produces for obj nested depth levels deep
+        return json.dumps(obj, indent='\t', cls=AlchemyEncoder).replace('\n', '\n' + '\t' * depth)
+
+    def encode_array(self, fragments):
+        if not fragments:
+            return '[]'
+        return '[\n\t\t' + ',\n\t\t'.join(fragments) + '\n\t]'
+
+
+    def class_cache_listener(self,args):
+        self.fragments.invalidate('RaceClass', args.get('class_id', args.get('output_class_id')))
+        self.fragments.invalidate('FPVScores_results')
+
+    def class_delete_cache_listener(self,args):
+        # Heats of a deleted class are moved out of it without their own events
+        self.fragments.invalidate('RaceClass', args['class_id'])
+        self.fragments.invalidate('Heat')
+        self.fragments.invalidate('FPVScores_results')
+
+    def heat_cache_listener(self,args):
+        if 'heat_id' in args:
+            self.fragments.invalidate('Heat', args['heat_id'])
+            self.fragments.invalidate('HeatNode', group=args['heat_id'])
+        else:
+            self.fragments.invalidate('RaceClass', args.get('output_class_id'))
+        self.fragments.invalidate('FPVScores_results')
+
+    def pilot_cache_listener(self,args):
+        self.fragments.invalidate('Pilot', args['pilot_id'])
+        self.fragments.invalidate('FPVScores_results')
+
+    def pilot_delete_cache_listener(self,args):
+        # Slots of a deleted pilot are emptied without their own events
+        self.fragments.invalidate('Pilot', args['pilot_id'])
+        self.fragments.invalidate('HeatNode')
+        self.fragments.invalidate('FPVScores_results')
+
+    def laps_cache_listener(self,args):
+        savedracemeta = self._rhapi.db.race_by_id(args['race_id'])
+        if savedracemeta is not None:
+            self.fragments.invalidate('Heat', savedracemeta.heat_id)
+            self.fragments.invalidate('HeatNode', group=savedracemeta.heat_id)
+            self.fragments.invalidate('RaceClass', savedracemeta.class_id)
+        else:
+            self.fragments.invalidate('Heat')
+            self.fragments.invalidate('HeatNode')
+            self.fragments.invalidate('RaceClass')
+        self.fragments.invalidate('FPVScores_results')
+
+    def option_cache_listener(self,args):
+        self.fragments.invalidate('GlobalSettings')
+        self.fragments.invalidate('FPVScores_results')
+
+    def clear_cache_listener(self,args):
+        self.fragments.clear()
 
 
 
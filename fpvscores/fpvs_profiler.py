@@ -0,0 +1,189 @@
+import cProfile
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+_NULL_SPAN = nullcontext()
+
+
+class FPVSProfiler():
+    PROFILE_DIR = 'plugins/fpvscores/profiling'
+    MAX_EVENTS = 100000
+    MAX_SLOWEST = 5
+
+    def __init__(self,rhapi):
+        self.logger = logging.getLogger(__name__)
+        self._rhapi = rhapi
+        self.enabled = False
+        self.cprofile = False
+        self._events = deque(maxlen=self.MAX_EVENTS)
+        self._slowest = []
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cprofile_active = False
+        self._origin = time.perf_counter_ns()
+        self._pid = os.getpid()
+
+    def load_options(self,args=None):
+        db = self._rhapi.db
+        self.enabled = db.option("fpvscores_profiling") == "1"
+        self.cprofile = self.enabled and db.option("fpvscores_profiling_cprofile") == "1"
+        if self.enabled:
+            self.logger.info("FPVScores.com profiling is enabled")
+        else:
+            self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+            self._slowest = []
+
+    def option_listener(self,args):
+        if args.get("option") in ("fpvscores_profiling", "fpvscores_profiling_cprofile"):
+            self.load_options()
+
+    def _now_us(self):
+        return (time.perf_counter_ns() - self._origin) / 1000
+
+    def _record(self, name, cat, start, end, args):
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start,
+            "dur": end - start,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    def span(self, name, cat, **args):
+        # Spans are free when profiling is off: a shared no-op context is returned
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, cat, args)
+
+    @contextmanager
+    def _span(self, name, cat, args):
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            self._record(name, cat, start, self._now_us(), args)
+
+    def wrap(self, fn, name=None):
+        name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return fn(*args, **kwargs)
+            return self._run(name, fn, args, kwargs)
+
+        return wrapper
+
+    def _run(self, name, fn, args, kwargs):
+        span_args = {}
+        if args and isinstance(args[0], dict) and "_eventName" in args[0]:
+            span_args["event"] = args[0]["_eventName"]
+
+        depth = getattr(self._local, "depth", 0)
+        profile = None
+        if depth == 0 and self.cprofile:
+            with self._lock:
+                if not self._cprofile_active:
+                    self._cprofile_active = True
+                    profile = cProfile.Profile()
+
+        self._local.depth = depth + 1
+        start = self._now_us()
+        try:
+            if profile is not None:
+                profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+        finally:
+            end = self._now_us()
+            self._local.depth = depth
+            self._record(name, "handler", start, end, span_args)
+            if profile is not None:
+                self._keep_profile(name, end - start, profile)
+
+    def _keep_profile(self, name, duration, profile):
+        # Only the cProfile stats of the slowest invocations are retained
+        with self._lock:
+            self._cprofile_active = False
+            self._seq += 1
+            self._keep_slowest((duration, self._seq, name, profile))
+
+    def _keep_slowest(self, entry):
+        if len(self._slowest) < self.MAX_SLOWEST:
+            heapq.heappush(self._slowest, entry)
+        elif entry[0] > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def write_trace(self):
+        os.makedirs(self.PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+
+        # Buffers are taken over by this trace so a later write only holds newer spans
+        with self._lock:
+            events = list(self._events)
+            slowest = sorted(self._slowest, reverse=True)
+            self._events.clear()
+            self._slowest = []
+
+        try:
+            return self._write_trace(stamp, events, slowest)
+        except Exception:
+            with self._lock:
+                self._events.extendleft(reversed(events))
+                for entry in slowest:
+                    self._keep_slowest(entry)
+            raise
+
+    def _write_trace(self, stamp, events, slowest):
+        metadata = {
+            "name": "process_name",
+            "ph": "M",
+            "pid": self._pid,
+            "args": {"name": "FPVScores Sync"}
+        }
+        trace = {
+            "traceEvents": [metadata, *events],
+            "displayTimeUnit": "ms"
+        }
+        trace_path = os.path.join(self.PROFILE_DIR, "fpvscores_trace_" + stamp + ".json")
+        with open(trace_path, "w") as file:
+            json.dump(trace, file)
+
+        for rank, (duration, seq, name, profile) in enumerate(slowest, start=1):
+            profile.dump_stats(os.path.join(self.PROFILE_DIR, "fpvscores_" + stamp + "_" + str(rank) + "_" + name + ".prof"))
+
+        return trace_path
+
+    def runWriteTraceBtn(self,args):
+        rhapi = self._rhapi
+        if not self._events:
+            rhapi.ui.message_notify(rhapi.__("FPVScores: No profiling data recorded. Enable profiling first."))
+            return
+        try:
+            trace_path = self.write_trace()
+        except Exception:
+            self.logger.exception("FPVScores.com profiling trace could not be written")
+            rhapi.ui.message_notify(rhapi.__("FPVScores: Profiling trace could not be written."))
+            return
+        self.logger.info("FPVScores.com profiling trace written to " + trace_path)
+        rhapi.ui.message_notify(rhapi.__("FPVScores: Profiling trace written to " + trace_path))
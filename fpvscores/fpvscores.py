@@ -4,6 +4,7 @@ from sqlalchemy import inspect
 import requests
 import logging
 from RHUI import UIField, UIFieldType, UIFieldSelectOption
+from .fpvs_avatars import FPVSAvatars
 
 class FPVScores():
     FPVS_VERSION = "2.0.0"
@@ -22,9 +23,11 @@ class FPVScores():
     options.sort(key=lambda x: x.label)
     country_ui_field = UIField('country', "Country Code", UIFieldType.SELECT, options=options, value="")
 
-    def __init__(self,rhapi):
+    def __init__(self,rhapi,profiler):
         self.logger = logging.getLogger(__name__)
         self._rhapi = rhapi
+        self.profiler = profiler
+        self.avatars = FPVSAvatars(rhapi, profiler, self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=pilot_avatar&fpvs_uuid={}")
 
     def init_plugin(self,args):
         isEnabled = self.isEnabled()
@@ -58,13 +61,18 @@ class FPVScores():
 
         ui_fpvscores_autosync = UIField(name = 'fpvscores_autoupload', label = 'Enable Automatic Sync', field_type = UIFieldType.CHECKBOX, desc = "Enable or disable automatic syncing. A network connection is required.")
         ui_fpvscores_event_uuid = UIField(name = 'fpvscores_event_uuid', label = 'FPV Scores Event UUID', field_type = UIFieldType.TEXT, desc = "Event UUID obtainable from FPVScores.com")
+        ui_fpvscores_profiling = UIField(name = 'fpvscores_profiling', label = 'Enable Sync Profiling', field_type = UIFieldType.CHECKBOX, desc = "Record timed spans of every sync handler for export as a Chrome/Perfetto trace.")
+        ui_fpvscores_profiling_cprofile = UIField(name = 'fpvscores_profiling_cprofile', label = 'Capture cProfile Stats', field_type = UIFieldType.CHECKBOX, desc = "Keep cProfile stats of the slowest sync handler invocations. Requires profiling to be enabled.")
 
         fields = self._rhapi.fields
         fields.register_option(ui_fpvscores_autosync, "fpvscores_sync")
         fields.register_option(ui_fpvscores_event_uuid, "fpvscores_sync")
+        fields.register_option(ui_fpvscores_profiling, "fpvscores_sync")
+        fields.register_option(ui_fpvscores_profiling_cprofile, "fpvscores_sync")
 
-        ui.register_quickbutton("fpvscores_sync", "fpvscores_syncpilots", "Full Manual Sync", self.runFullManualSyncBtn, {'rhapi': self._rhapi})
-        ui.register_quickbutton("fpvscores_sync", "fpvscores_clear", "Clear event data on FPVScores.com", self.runClearBtn, {'rhapi': self._rhapi})
+        ui.register_quickbutton("fpvscores_sync", "fpvscores_syncpilots", "Full Manual Sync", self.profiler.wrap(self.runFullManualSyncBtn), {'rhapi': self._rhapi})
+        ui.register_quickbutton("fpvscores_sync", "fpvscores_clear", "Clear event data on FPVScores.com", self.profiler.wrap(self.runClearBtn), {'rhapi': self._rhapi})
+        ui.register_quickbutton("fpvscores_sync", "fpvscores_writetrace", "Write profiling trace", self.profiler.runWriteTraceBtn, {'rhapi': self._rhapi})
 
         fields.register_pilot_attribute( self.country_ui_field )
         fields.register_pilot_attribute( UIField('safetycheck', "Safety Checked", UIFieldType.CHECKBOX) )
@@ -73,11 +81,13 @@ class FPVScores():
         fields.register_pilot_attribute( UIField('comm_tbs_mac', "Fusion MAC Address", UIFieldType.TEXT) )
     
 
+        # The pilot_avatar endpoint is not confirmed by FPVScores.com yet, keep the button hidden until it is
         #ui.register_quickbutton("fpvscores_sync", "fpvscores_downloadavatars", "Download Pilot Avatars", self.runDownloadAvatarsBtn, {'rhapi': self._rhapi})
 
     def isConnected(self):
         try:
-            response = requests.get(self.FPVS_API_ENDPOINT, timeout=5)
+            with self.profiler.span('isConnected', 'network'):
+                response = requests.get(self.FPVS_API_ENDPOINT, timeout=5)
             return True
         except requests.ConnectionError:
             return False 
@@ -117,14 +127,16 @@ class FPVScores():
 
             elif eventname == "classAlter":
                 classid = args["class_id"]
-                raceclass = self._rhapi.db.raceclass_by_id(classid)
+                with self.profiler.span('raceclass_by_id', 'db'):
+                    raceclass = self._rhapi.db.raceclass_by_id(classid)
                 classname = raceclass.name
                 classdescription = raceclass.description
                 brackettype = "check"
 
             elif eventname == "heatGenerate":
                 classid = args["output_class_id"]
-                raceclass = self._rhapi.db.raceclass_by_id(classid)
+                with self.profiler.span('raceclass_by_id', 'db'):
+                    raceclass = self._rhapi.db.raceclass_by_id(classid)
                 if raceclass.name == "":
                     classname = "Class " + str(classid)
                 else:
@@ -140,7 +152,8 @@ class FPVScores():
                 "class_bracket_type": brackettype,
                 "event_name": eventname
             }
-            x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=class_update", json = payload)
+            with self.profiler.span('class_update', 'network'):
+                x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=class_update", json = payload)
             self.UI_Message(rhapi,x.text)
 
 
@@ -155,6 +168,10 @@ class FPVScores():
         return brackettype
     
     def UI_Message(self, rhapi, text):
+        with self.profiler.span('UI_Message', 'ui'):
+            self._UI_Message(rhapi, text)
+
+    def _UI_Message(self, rhapi, text):
         try:
             parsed_text = json.loads(text)
             # Controleer of het een lijst is en haal het eerste item
@@ -178,16 +195,18 @@ class FPVScores():
         if self.isConnected() and self.isEnabled() and keys["notempty"]:
 
             db = self._rhapi.db
-            heat = db.heat_by_id(args["heat_id"])
             groups = []
-            thisheat = self.getGroupingDetails(heat,db)
+            with self.profiler.span('getGroupingDetails', 'db'):
+                heat = db.heat_by_id(args["heat_id"])
+                thisheat = self.getGroupingDetails(heat,db)
             groups.append(thisheat)
 
             payload = {
                 "event_uuid": keys["event_uuid"],
                 "heats": groups
             }
-            x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=heat_update", json = payload)
+            with self.profiler.span('heat_update', 'network'):
+                x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=heat_update", json = payload)
             self.UI_Message(rhapi,x.text)
 
 
@@ -202,7 +221,8 @@ class FPVScores():
                 "event_uuid": keys["event_uuid"],
                 "class_id": args["class_id"]
             }
-            x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=class_delete", json = payload)
+            with self.profiler.span('class_delete', 'network'):
+                x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=class_delete", json = payload)
             self.UI_Message(rhapi,x.text)
             #print(x.text)
         else:
@@ -217,7 +237,8 @@ class FPVScores():
                 "event_uuid": keys["event_uuid"],
                 "heat_id": args["heat_id"]
             }
-            x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=heat_delete", json = payload)
+            with self.profiler.span('heat_delete', 'network'):
+                x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=heat_delete", json = payload)
             self.UI_Message(rhapi,x.text)
             #print(x.text)
         else:
@@ -230,24 +251,26 @@ class FPVScores():
             eventname = args["_eventName"]
             if eventname == "pilotAdd":
                 pilotid = args["pilot_id"]
-                pilot = self._rhapi.db.pilot_by_id(pilotid)
+                with self.profiler.span('pilot_by_id', 'db'):
+                    pilot = self._rhapi.db.pilot_by_id(pilotid)
+                    fpvsuuid = rhapi.db.pilot_attribute_value(pilot.id, 'fpvs_uuid')
+                    country = rhapi.db.pilot_attribute_value(pilot.id, 'country')
                 callsign = pilot.callsign
                 name = pilot.name
                 team = pilot.team
                 phonetic = pilot.phonetic
-                fpvsuuid = rhapi.db.pilot_attribute_value(pilot.id, 'fpvs_uuid')
-                country = rhapi.db.pilot_attribute_value(pilot.id, 'country')
                 color = pilot.color
                 
             elif eventname == "pilotAlter":
                 pilotid = args["pilot_id"]
-                pilot = self._rhapi.db.pilot_by_id(pilotid)
+                with self.profiler.span('pilot_by_id', 'db'):
+                    pilot = self._rhapi.db.pilot_by_id(pilotid)
+                    fpvsuuid = rhapi.db.pilot_attribute_value(pilot.id, 'fpvs_uuid')
+                    country = rhapi.db.pilot_attribute_value(pilot.id, 'country')
                 callsign = pilot.callsign
                 name = pilot.name
                 team = pilot.team
                 phonetic = pilot.phonetic
-                fpvsuuid = rhapi.db.pilot_attribute_value(pilot.id, 'fpvs_uuid')
-                country = rhapi.db.pilot_attribute_value(pilot.id, 'country')
                 color = pilot.color
 
 
@@ -263,7 +286,8 @@ class FPVScores():
                 "color": color,
                 "event_name": eventname
             }
-            x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=pilot_update", json = payload)
+            with self.profiler.span('pilot_update', 'network'):
+                x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=pilot_update", json = payload)
             print(x.text)
             self.UI_Message(rhapi,x.text)
 
@@ -333,7 +357,8 @@ class FPVScores():
         payload = {
             "event_uuid": keys["event_uuid"],
         }
-        x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=rh_clear", json = payload)
+        with self.profiler.span('rh_clear', 'network'):
+            x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=rh_clear", json = payload)
         print(x.text)
         self.UI_Message(rhapi,x.text)
 
@@ -347,12 +372,17 @@ class FPVScores():
         json_data =  input_data['data']
         url = self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=full_manual_import"
         headers = {'Authorization' : 'rhconnect', 'Accept' : 'application/json', 'Content-Type' : 'application/json'}
-        r = requests.post(url, data=json_data, headers=headers)
+        with self.profiler.span('full_manual_import', 'network'):
+            r = requests.post(url, data=json_data, headers=headers)
         self.UI_Message(rhapi,r.text)
         print(r.text)
 
-    def runDownloadAvatarsBtn(args):
-        print('run download avatars by frontend button')
+    def runDownloadAvatarsBtn(self,args):
+        rhapi = self._rhapi
+        if self.avatars.start_download():
+            rhapi.ui.message_notify(rhapi.__("FPVScores: Downloading pilot avatars."))
+        else:
+            rhapi.ui.message_notify(rhapi.__("FPVScores: Avatar download already running."))
 
 
     def laptime_listener(self,args):
@@ -363,24 +393,27 @@ class FPVScores():
 
             raceid = args["race_id"]
 
-            savedracemeta = self._rhapi.db.race_by_id(raceid)
+            with self.profiler.span('race_by_id', 'db'):
+                savedracemeta = self._rhapi.db.race_by_id(raceid)
+                raceclass = self._rhapi.db.raceclass_by_id(savedracemeta.class_id)
             classid = savedracemeta.class_id
             heatid = savedracemeta.heat_id
             roundid = savedracemeta.round_id
-
-            raceclass = self._rhapi.db.raceclass_by_id(classid)
             classname = raceclass.name
 
-            raceresults = self._rhapi.db.race_results(raceid)
+            with self.profiler.span('race_results', 'db'):
+                raceresults = self._rhapi.db.race_results(raceid)
             primary_leaderboard = raceresults["meta"]["primary_leaderboard"]
             filteredraceresults = raceresults[primary_leaderboard]
 
-            pilotruns = self._rhapi.db.pilotruns_by_race(raceid)
+            with self.profiler.span('pilotruns_by_race', 'db'):
+                pilotruns = self._rhapi.db.pilotruns_by_race(raceid)
 
             pilotlaps = []
             for run in pilotruns:
                 runid = run.id
-                laps = self._rhapi.db.laps_by_pilotrun(runid)
+                with self.profiler.span('laps_by_pilotrun', 'db'):
+                    laps = self._rhapi.db.laps_by_pilotrun(runid)
                 for lap in laps:
 
                     if lap.deleted == False:
@@ -409,7 +442,8 @@ class FPVScores():
                 "pilotlaps": pilotlaps
             }
 
-            x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=laptimes_update", json = payload)
+            with self.profiler.span('laptimes_update', 'network'):
+                x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=laptimes_update", json = payload)
             #print(x.text)
             self.UI_Message(rhapi,x.text)
             self.logger.info("Laps sent to cloud")
@@ -421,10 +455,10 @@ class FPVScores():
         keys = self.getEventUUID()
 
         self.laptime_listener(args)
-        savedracemeta = self._rhapi.db.race_by_id(args["race_id"])
-        classid = savedracemeta.class_id
-  
-        raceclass = self._rhapi.db.raceclass_by_id(classid)
+        with self.profiler.span('race_by_id', 'db'):
+            savedracemeta = self._rhapi.db.race_by_id(args["race_id"])
+            classid = savedracemeta.class_id
+            raceclass = self._rhapi.db.raceclass_by_id(classid)
         classname = raceclass.name
         ranking = raceclass.ranking
         if self.isConnected() and self.isEnabled() and keys["notempty"]:
@@ -478,7 +512,8 @@ class FPVScores():
                         rankpayload.append(pilot)    
 
             db = self._rhapi.db    
-            fullresults = db.raceclass_results(classid)
+            with self.profiler.span('raceclass_results', 'db'):
+                fullresults = db.raceclass_results(classid)
             if fullresults is not None:
                 meta = fullresults["meta"]
                 leaderboards = ["by_consecutives", "by_race_time", "by_fastest_lap"]
@@ -525,7 +560,8 @@ class FPVScores():
                     "results": resultpayload,
                     "classid": classid
                 }
-                x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=leaderboard_update", json = payload)
+                with self.profiler.span('leaderboard_update', 'network'):
+                    x = requests.post(self.FPVS_API_ENDPOINT+"/rh/"+self.FPVS_API_VERSION+"/?action=leaderboard_update", json = payload)
                 print(x.text)
                 self.UI_Message(rhapi,x.text)
 
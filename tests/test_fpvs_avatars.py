@@ -0,0 +1,160 @@
+import hashlib
+import importlib.util
+import os
+import threading
+import types
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'fpvscores')
+
+
+def load_module(name):
+    # The plugin package imports RotorHazard modules on import, these modules do not
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGIN_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+fpvs_avatars = load_module('fpvs_avatars')
+fpvs_profiler = load_module('fpvs_profiler')
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'avatar'
+
+
+class StubAvatarHandler(BaseHTTPRequestHandler):
+    # fpvs_uuid -> (status, content type, body)
+    replies = {}
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        fpvs_uuid = parse_qs(urlparse(self.path).query)['fpvs_uuid'][0]
+        self.requests.append((fpvs_uuid, self.headers.get('If-None-Match')))
+        status, content_type, body = self.replies.get(fpvs_uuid, (404, 'application/json', b'{}'))
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    StubAvatarHandler.replies = {}
+    StubAvatarHandler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubAvatarHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def avatars(server, tmp_path):
+    url = 'http://127.0.0.1:' + str(server.server_address[1]) + '/?fpvs_uuid={}'
+    avatars = fpvs_avatars.FPVSAvatars(None, fpvs_profiler.FPVSProfiler(None), url)
+    avatars.CACHE_DIR = str(tmp_path)
+    return avatars
+
+
+def cached_files(avatars):
+    return sorted(f for f in os.listdir(avatars.CACHE_DIR) if f != 'index.json')
+
+
+def test_download_then_not_modified(avatars):
+    StubAvatarHandler.replies = {'a': (200, 'image/png', PNG), 'b': (200, 'image/png', PNG)}
+
+    summary = avatars.refresh({'a': 1, 'b': 2})
+    assert summary == {'downloaded': 2, 'unchanged': 0, 'missing': 0, 'failed': 0}
+    # Both pilots share one content-addressed file
+    assert cached_files(avatars) == [hashlib.sha256(PNG).hexdigest() + '.png']
+
+    summary = avatars.refresh({'a': 1, 'b': 2})
+    assert summary == {'downloaded': 0, 'unchanged': 2, 'missing': 0, 'failed': 0}
+    assert all(etag is not None for uuid, etag in StubAvatarHandler.requests[2:])
+
+
+def test_not_found_evicts_avatar(avatars):
+    StubAvatarHandler.replies = {'a': (200, 'image/png', PNG)}
+    avatars.refresh({'a': 1})
+
+    StubAvatarHandler.replies = {}
+    summary = avatars.refresh({'a': 1})
+    assert summary['missing'] == 1
+    assert 'a' not in avatars.load_index()
+    assert cached_files(avatars) == []
+
+
+def test_non_image_reply_keeps_avatar(avatars):
+    StubAvatarHandler.replies = {'a': (200, 'image/png', PNG)}
+    avatars.refresh({'a': 1})
+
+    StubAvatarHandler.replies = {'a': (200, 'application/json', b'{"status":"error","message":"x"}')}
+    summary = avatars.refresh({'a': 1})
+    assert summary['failed'] == 1
+    assert 'a' in avatars.load_index()
+    assert len(cached_files(avatars)) == 1
+
+
+def test_svg_and_oversized_replies_are_rejected(avatars):
+    avatars.MAX_BYTES = 16
+    StubAvatarHandler.replies = {
+        'svg': (200, 'image/svg+xml', b'<svg onload="alert(1)"/>'),
+        'big': (200, 'image/png', PNG * 4)
+    }
+
+    summary = avatars.refresh({'svg': 1, 'big': 2})
+    assert summary['failed'] == 2
+    assert cached_files(avatars) == []
+
+
+def test_unreferenced_files_are_removed(avatars):
+    StubAvatarHandler.replies = {'a': (200, 'image/png', PNG), 'b': (200, 'image/gif', b'GIF89a')}
+    avatars.refresh({'a': 1, 'b': 2})
+    with open(os.path.join(avatars.CACHE_DIR, 'stray.png'), 'wb') as file:
+        file.write(b'stray')
+
+    avatars.refresh({'a': 1})
+    assert list(avatars.load_index()) == ['a']
+    assert cached_files(avatars) == [hashlib.sha256(PNG).hexdigest() + '.png']
+
+
+def test_blank_uuids_are_skipped(avatars):
+    values = {1: ' a ', 2: '   ', 3: None, 4: ''}
+    avatars._rhapi = types.SimpleNamespace(db=types.SimpleNamespace(
+        pilots=[types.SimpleNamespace(id=pilot_id) for pilot_id in values],
+        pilot_attribute_value=lambda pilot_id, name: values[pilot_id]
+    ))
+
+    assert avatars.pilot_uuids() == {'a': 1}
+
+
+@pytest.mark.parametrize('index', [
+    '[]',
+    '{"a": "x.png"}',
+    '{"a": {"etag": "\\"1\\""}}',
+    '{"a": {"file": 5}}',
+])
+def test_malformed_index_entries_are_dropped(avatars, index):
+    with open(avatars.index_path(), 'w') as file:
+        file.write(index)
+    StubAvatarHandler.replies = {'a': (200, 'image/png', PNG)}
+
+    summary = avatars.refresh({'a': 1})
+    assert summary['downloaded'] == 1
+    assert avatars.load_index()['a']['file'] == hashlib.sha256(PNG).hexdigest() + '.png'
@@ -0,0 +1,85 @@
+import importlib.util
+import os
+
+PLUGIN_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'fpvscores')
+
+
+def load_module(name):
+    # The plugin package imports RotorHazard modules on import, these modules do not
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGIN_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+fpvs_cache = load_module('fpvs_cache')
+
+
+def test_get_matches_version():
+    cache = fpvs_cache.FPVSFragmentCache()
+    cache.put('Heat', 1, '{"id": 1}', cache.generation('Heat'), version=('a',))
+
+    assert cache.get('Heat', 1, ('a',)) == '{"id": 1}'
+    assert cache.get('Heat', 1, ('b',)) is None
+    assert cache.get('Heat', 2, ('a',)) is None
+
+
+def test_put_is_dropped_after_racing_invalidate():
+    cache = fpvs_cache.FPVSFragmentCache()
+    generation = cache.generation('Pilot')
+    # A PILOT_ALTER arrives while the export is still encoding from older rows
+    cache.invalidate('Pilot', 2)
+    cache.put('Pilot', 1, '{"id": 1}', generation)
+
+    assert cache.get('Pilot', 1) is None
+
+    cache.put('Pilot', 1, '{"id": 1}', cache.generation('Pilot'))
+    assert cache.get('Pilot', 1) == '{"id": 1}'
+
+
+def test_put_is_dropped_after_racing_clear():
+    cache = fpvs_cache.FPVSFragmentCache()
+    generation = cache.generation('Pilot')
+    cache.clear()
+    cache.put('Pilot', 1, '{"id": 1}', generation)
+
+    assert cache.get('Pilot', 1) is None
+
+
+def test_group_invalidation_drops_slots_of_one_heat():
+    cache = fpvs_cache.FPVSFragmentCache()
+    generation = cache.generation('HeatNode')
+    cache.put('HeatNode', 1, 'slot 1', generation, group=10)
+    cache.put('HeatNode', 2, 'slot 2', generation, group=10)
+    cache.put('HeatNode', 3, 'slot 3', generation, group=20)
+
+    cache.invalidate('HeatNode', group=10)
+
+    assert cache.get('HeatNode', 1) is None
+    assert cache.get('HeatNode', 2) is None
+    assert cache.get('HeatNode', 3) == 'slot 3'
+
+
+def test_validate_drops_section_when_key_changes():
+    cache = fpvs_cache.FPVSFragmentCache()
+    cache.validate('HeatNode', 'R1 R2')
+    cache.put('HeatNode', 1, 'slot 1', cache.generation('HeatNode'))
+
+    cache.validate('HeatNode', 'R1 R2')
+    assert cache.get('HeatNode', 1) == 'slot 1'
+
+    cache.validate('HeatNode', 'F1 R2')
+    assert cache.get('HeatNode', 1) is None
+
+
+def test_prune_drops_deleted_ids():
+    cache = fpvs_cache.FPVSFragmentCache()
+    generation = cache.generation('Pilot')
+    for pilot_id in (1, 2, 3):
+        cache.put('Pilot', pilot_id, 'pilot ' + str(pilot_id), generation)
+
+    cache.prune('Pilot', [1, 3])
+
+    assert cache.get('Pilot', 1) == 'pilot 1'
+    assert cache.get('Pilot', 2) is None
+    assert cache.get('Pilot', 3) == 'pilot 3'
@@ -0,0 +1,187 @@
+import importlib.util
+import json
+import os
+import sys
+import types
+
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+PLUGIN_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'fpvscores')
+PACKAGE = 'fpvscores_under_test'
+
+
+def load_module(name):
+    # Loaded under a bare package so the plugin __init__ and its RotorHazard imports are skipped
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [PLUGIN_DIR]
+        sys.modules[PACKAGE] = package
+    spec = importlib.util.spec_from_file_location(PACKAGE + '.' + name, os.path.join(PLUGIN_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# data_export is provided by the RotorHazard server, only DataExporter is imported from it
+sys.modules.setdefault('data_export', types.SimpleNamespace(DataExporter=lambda *args: args))
+fpvs_export = load_module('fpvs_export')
+fpvs_profiler = load_module('fpvs_profiler')
+
+Base = declarative_base()
+
+
+class Pilot(Base):
+    __tablename__ = 'pilot'
+    id = Column(Integer, primary_key=True)
+    callsign = Column(String)
+    name = Column(String)
+
+
+class Heat(Base):
+    __tablename__ = 'heat'
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    status = Column(Integer)
+    _cache_status = Column(String)
+
+
+class HeatNode(Base):
+    __tablename__ = 'heat_node'
+    id = Column(Integer, primary_key=True)
+    heat_id = Column(Integer)
+    node_index = Column(Integer)
+    pilot_id = Column(Integer)
+
+
+class RaceClass(Base):
+    __tablename__ = 'race_class'
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    _cache_status = Column(String)
+
+
+class GlobalSettings(Base):
+    __tablename__ = 'global_settings'
+    id = Column(Integer, primary_key=True)
+    option_name = Column(String)
+    option_value = Column(String)
+
+
+class StubDB():
+    def __init__(self):
+        self.pilots = [Pilot(id=i, callsign='Pilot ' + str(i), name='Name "' + str(i) + '"\n') for i in (1, 2, 3)]
+        self.heats = [Heat(id=1, name='Heat 1', status=0, _cache_status='a'), Heat(id=2, name='Heat 2', status=0, _cache_status='a')]
+        self.slots = [HeatNode(id=i, heat_id=1 + i % 2, node_index=i % 3, pilot_id=i) for i in (1, 2, 3, 4)]
+        self.raceclasses = [RaceClass(id=1, name='Open', _cache_status='a')]
+        self.options = [GlobalSettings(id=1, option_name='eventName', option_value='Race')]
+        self.attribute_lookups = 0
+
+    def pilot_attribute_value(self, pilot_id, name):
+        self.attribute_lookups += 1
+        return 'NL' if name == 'country' else 'uuid-' + str(pilot_id)
+
+
+class StubRHAPI():
+    def __init__(self):
+        self.db = StubDB()
+        self.race = types.SimpleNamespace(frequencyset=types.SimpleNamespace(frequencies=json.dumps({
+            'b': ['R', 'R', None], 'c': [1, 2, None], 'f': [5658, 5695, 0]
+        })))
+        self.eventresults = types.SimpleNamespace(results={'heats': {'1': {'leaderboard': []}}, 'classes': {}})
+
+
+@pytest.fixture
+def rhapi():
+    return StubRHAPI()
+
+
+@pytest.fixture
+def exporter(rhapi):
+    return fpvs_export.FPVSExport(rhapi, fpvs_profiler.FPVSProfiler(rhapi))
+
+
+def export(exporter, rhapi):
+    return exporter.write_json(exporter.assemble_fpvscoresUpload(rhapi))['data']
+
+
+def reference(rhapi):
+    # The encoding the exporter produced before fragments were cached
+    payload = {
+        'import_settings': 'upload_FPVScores',
+        'Pilot': rhapi.db.pilots,
+        'Heat': rhapi.db.heats,
+        'HeatNode': rhapi.db.slots,
+        'RaceClass': rhapi.db.raceclasses,
+        'GlobalSettings': rhapi.db.options,
+        'FPVScores_results': rhapi.eventresults.results
+    }
+    return json.dumps(payload, indent='\t', cls=fpvs_export.AlchemyEncoder)
+
+
+def test_output_matches_full_encode(exporter, rhapi):
+    assert export(exporter, rhapi) == reference(rhapi)
+    assert export(exporter, rhapi) == reference(rhapi)
+
+
+def test_empty_sections_match_full_encode(exporter, rhapi):
+    rhapi.db.raceclasses = []
+    rhapi.db.options = []
+    assert export(exporter, rhapi) == reference(rhapi)
+
+
+def test_only_invalidated_pilots_are_completed(exporter, rhapi):
+    export(exporter, rhapi)
+    lookups = rhapi.db.attribute_lookups
+
+    export(exporter, rhapi)
+    assert rhapi.db.attribute_lookups == lookups
+
+    rhapi.db.pilots[1].callsign = 'Renamed'
+    exporter.pilot_cache_listener({'pilot_id': 2})
+    output = export(exporter, rhapi)
+    assert rhapi.db.attribute_lookups == lookups + 2
+    assert '"callsign": "Renamed"' in output
+    assert output == reference(rhapi)
+
+
+def test_frequency_change_reencodes_slots(exporter, rhapi):
+    export(exporter, rhapi)
+    rhapi.race.frequencyset.frequencies = json.dumps({'b': ['F', 'R', None], 'c': [1, 2, None], 'f': [5740, 5695, 0]})
+
+    output = export(exporter, rhapi)
+    assert '"node_frequency_band": "F"' in output
+    assert '"node_frequency_f": 5658' not in output
+
+
+def test_heat_listener_drops_only_its_slots(exporter, rhapi):
+    export(exporter, rhapi)
+    exporter.heat_cache_listener({'heat_id': 1})
+
+    assert exporter.fragments.get('HeatNode', 2, (2,)) is None
+    assert exporter.fragments.get('HeatNode', 1, (1,)) is not None
+
+
+def test_deleted_pilots_are_pruned(exporter, rhapi):
+    export(exporter, rhapi)
+    del rhapi.db.pilots[0]
+
+    output = export(exporter, rhapi)
+    assert '"callsign": "Pilot 1"' not in output
+    assert exporter.fragments.get('Pilot', 1) is None
+    assert output == reference(rhapi)
+
+
+def test_results_follow_results_cache_markers(exporter, rhapi):
+    export(exporter, rhapi)
+    # A race format change makes RotorHazard recompute results without any listened event
+    rhapi.eventresults.results = {'heats': {'1': {'leaderboard': ['recomputed']}}, 'classes': {}}
+    rhapi.db.heats[0]._cache_status = 'b'
+
+    output = export(exporter, rhapi)
+    assert '"recomputed"' in output
+    assert output == reference(rhapi)
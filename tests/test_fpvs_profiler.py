@@ -0,0 +1,134 @@
+import importlib.util
+import json
+import os
+import types
+
+import pytest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'fpvscores')
+
+
+def load_module(name):
+    # The plugin package imports RotorHazard modules on import, these modules do not
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PLUGIN_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+fpvs_profiler = load_module('fpvs_profiler')
+
+
+class StubRHAPI():
+    def __init__(self, options):
+        self.options = options
+        self.messages = []
+        self.db = types.SimpleNamespace(option=lambda name: self.options.get(name, "0"))
+        self.ui = types.SimpleNamespace(message_notify=self.messages.append)
+
+    def __(self, text):
+        return text
+
+
+@pytest.fixture
+def rhapi():
+    return StubRHAPI({"fpvscores_profiling": "1", "fpvscores_profiling_cprofile": "0"})
+
+
+@pytest.fixture
+def profiler(rhapi, tmp_path):
+    profiler = fpvs_profiler.FPVSProfiler(rhapi)
+    profiler.PROFILE_DIR = str(tmp_path)
+    profiler.load_options()
+    return profiler
+
+
+def test_disabled_profiler_records_nothing(rhapi):
+    rhapi.options["fpvscores_profiling"] = "0"
+    profiler = fpvs_profiler.FPVSProfiler(rhapi)
+    profiler.load_options()
+
+    handler = profiler.wrap(lambda args: args["value"] * 2)
+    assert handler({"value": 21}) == 42
+    with profiler.span('db.pilots', 'db'):
+        pass
+    assert not profiler._events
+
+
+def test_wrap_and_span_record_events(profiler):
+    def class_listener(args):
+        with profiler.span('raceclass_by_id', 'db'):
+            return args["class_id"]
+
+    assert profiler.wrap(class_listener)({"_eventName": "classAlter", "class_id": 3}) == 3
+    events = {event["name"]: event for event in profiler._events}
+    assert events["raceclass_by_id"]["cat"] == "db"
+    assert events["class_listener"]["cat"] == "handler"
+    assert events["class_listener"]["args"] == {"event": "classAlter"}
+
+
+def test_nested_handlers_start_one_cprofile(rhapi, profiler, monkeypatch):
+    rhapi.options["fpvscores_profiling_cprofile"] = "1"
+    profiler.load_options()
+
+    created = []
+
+    class CountingProfile(fpvs_profiler.cProfile.Profile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(fpvs_profiler.cProfile, 'Profile', CountingProfile)
+
+    inner = profiler.wrap(lambda: None, name='inner')
+    outer = profiler.wrap(lambda: inner(), name='outer')
+    outer()
+
+    assert len(created) == 1
+    assert [entry[2] for entry in profiler._slowest] == ['outer']
+
+
+def test_slowest_keeps_top_entries(profiler):
+    for duration in [7, 1, 9, 3, 5, 2, 8, 4, 6, 0]:
+        profiler._keep_slowest((duration, duration, 'handler', None))
+
+    assert sorted(entry[0] for entry in profiler._slowest) == [5, 6, 7, 8, 9]
+
+
+def test_write_trace_takes_over_buffers(profiler, tmp_path):
+    profiler.wrap(lambda: None, name='heat_listener')()
+
+    trace_path = profiler.write_trace()
+    with open(trace_path) as file:
+        trace = json.load(file)
+    assert [event["name"] for event in trace["traceEvents"][1:]] == ['heat_listener']
+    assert not profiler._events
+    assert not profiler._slowest
+
+
+def test_write_trace_restores_buffers_on_failure(profiler, monkeypatch):
+    profiler.wrap(lambda: None, name='heat_listener')()
+    profiler._keep_slowest((10, 1, 'heat_listener', None))
+    events = list(profiler._events)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(profiler, '_write_trace', fail)
+    with pytest.raises(OSError):
+        profiler.write_trace()
+
+    assert list(profiler._events) == events
+    assert profiler._slowest == [(10, 1, 'heat_listener', None)]
+
+
+def test_write_trace_button_notifies_failure(rhapi, profiler, monkeypatch):
+    profiler.wrap(lambda: None, name='heat_listener')()
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(profiler, '_write_trace', fail)
+    profiler.runWriteTraceBtn({})
+
+    assert rhapi.messages == ["FPVScores: Profiling trace could not be written."]